@@ -6,14 +6,53 @@
 #
 # Errors: print exactly one line to stderr starting with "ERROR -- " and exit 66.
 
+import mmap
+import os
 import re
 import sys
 from typing import Iterator, List, Tuple
-
-# Regexes for token classification
-BIN_RE = re.compile(r"^[01]+$")
-SIMPLE_STR_RE = re.compile(r"^([A-Za-z0-9 \t]+)s$")
-KEY_RE = re.compile(r"^[a-z]+$")  # keys: lowercase only per spec
+from urllib.parse import unquote_to_bytes
+
+# Anchored scanner for the hot path: a single match() call run by the C
+# regex engine replaces a Python-level char-at-a-time loop. Keys are runs
+# of lowercase letters; value tokens are cut at the next delimiter with
+# str.find (memchr under the hood) and validated afterwards. This is the
+# extent of "compiled" code here on purpose: the tool must stay a single
+# stdlib-only file runnable as `python deserializer.py`, so the per-byte
+# work is pushed into CPython's C primitives rather than an extension.
+# For the same reason there is no per-schema specialization: each process
+# parses exactly one document, so generated code could never amortize its
+# compile cost before the process exits.
+_KEY_SCAN = re.compile(r"[a-z]+")
+_WS_RUN = re.compile(r"\s*")  # leading/trailing slack around the outer map
+
+# Character-class bits, one byte per code point, shared by every scan in
+# the grammar (keys, nums, simple/complex strings). A token is
+# OR-accumulated through the table and classified from the final flag set,
+# replacing several regex fullmatch passes with a single left-to-right scan.
+_WS = 1       # ' ' or '\t' (legal only in simple-string bodies)
+_PCT = 2      # '%' (marks a complex string)
+_BIN = 4      # '0' or '1' (num digits; also legal in simple-strings)
+_ALNUM = 8    # [A-Za-z2-9] (simple-string body chars)
+_LOWER = 16   # [a-z] (key chars; always paired with _ALNUM)
+_OTHER = 32   # anything else (legal only in complex strings)
+_STRUCT = 64  # '(', ')', '<', ':' (never legal inside a value token)
+
+def _build_class_lut() -> bytes:
+    lut = bytearray([_OTHER]) * 256
+    lut[ord(' ')] = lut[ord('\t')] = _WS
+    lut[ord('%')] = _PCT
+    lut[ord('0')] = lut[ord('1')] = _BIN
+    for ch in "ABCDEFGHIJKLMNOPQRSTUVWXYZ23456789":
+        lut[ord(ch)] = _ALNUM
+    for ch in "abcdefghijklmnopqrstuvwxyz":
+        lut[ord(ch)] = _ALNUM | _LOWER
+    for ch in "()<:":
+        lut[ord(ch)] = _STRUCT
+    # bytes, not list: immutable, compact, and C-level integer indexing
+    return bytes(lut)
+
+_CLASS_LUT = _build_class_lut()
 
 class NosjError(Exception):
     pass
@@ -23,229 +62,283 @@ def _err(msg: str) -> Tuple[int, None]:
     return 66, None
 
 # -------- Percent-decoding for complex strings --------
-def _decode_percent_bytes(token: str) -> Tuple[str, bool]:
+# Any '%' not followed by exactly two hex digits is malformed.
+_BAD_PCT_RE = re.compile(r"%(?![0-9A-Fa-f]{2})")
+
+def _decode_percent_bytes(token: str) -> str:
     """
-    Decode %XX sequences to bytes. Returns (latin1_string, had_percent).
+    Decode %XX sequences to bytes and reinterpret the result as latin-1.
     Raises NosjError on malformed % escapes.
     """
-    out = bytearray()
-    i, n = 0, len(token)
-    had = False
-    while i < n:
-        ch = token[i]
-        if ch == '%':
-            if i + 2 >= n or any(c not in "0123456789abcdefABCDEF" for c in token[i+1:i+3]):
-                raise NosjError("Invalid percent-encoding in complex string")
-            b = int(token[i+1:i+3], 16)
-            out.append(b)
-            i += 3
-            had = True
-        else:
-            # raw ASCII byte
-            out.append(ord(ch))
-            i += 1
-    return out.decode('latin-1'), had
+    if _BAD_PCT_RE.search(token):
+        raise NosjError("Invalid percent-encoding in complex string")
+    # unquote_to_bytes splits on '%' and maps each hex pair through
+    # urllib's precomputed hex-pair-to-byte table, so no per-escape
+    # int(x, 16) happens at this level.
+    return unquote_to_bytes(token).decode('latin-1')
 
 
 # -------- Core tokenization (no whitespace allowed outside s-strings) --------
-class Cursor:
-    def __init__(self, s: str):
-        self.s = s
-        self.i = 0
-        self.n = len(s)
-
-    def peek(self, k: int = 0) -> str:
-        j = self.i + k
-        return self.s[j] if j < self.n else ''
-
-    def eat(self, ch: str) -> None:
-        if self.peek() != ch:
-            raise NosjError(f"Expected '{ch}'")
-        self.i += 1
-
-    def eat_seq(self, seq: str) -> None:
-        if self.s[self.i:self.i+len(seq)] != seq:
-            raise NosjError(f"Expected '{seq}'")
-        self.i += len(seq)
-
-    def at_end(self) -> bool:
-        return self.i >= self.n
-
-
-def _parse_key(cur: Cursor) -> str:
-    start = cur.i
-    while cur.peek().islower():
-        cur.i += 1
-    key = cur.s[start:cur.i]
-    if not key:
+# The input is sentinel-terminated: _parse_document appends a '\x00' after
+# stripping, so position checks never need explicit bounds tests -- the
+# sentinel is not a legal character anywhere in the grammar, so every scan
+# and delimiter check terminates on it naturally.
+#
+# The parse state is just (s, i): functions take the string and a position
+# and return the position they stopped at, avoiding a heap-allocated
+# cursor object and an attribute load per access.
+_SENTINEL = '\x00'
+
+
+def _parse_key(s: str, i: int) -> Tuple[str, int]:
+    # _KEY_SCAN only matches [a-z]+, so the key is valid by construction;
+    # a non-key character after it surfaces as a missing-':' error.
+    m = _KEY_SCAN.match(s, i)
+    if not m:
         raise NosjError("Missing key")
-    if not KEY_RE.fullmatch(key):
-        raise NosjError(f"Invalid key: {key!r}")
-    return key
+    return m.group(), m.end()
 
 
-def _parse_value(cur: Cursor) -> Tuple[str, str]:
+def _parse_value(s: str, i: int) -> Tuple[str, str, int]:
     """
-    Returns (type, value_string) where type in {'num','string','map'}.
-    For 'map', value_string is unused (empty).
+    Returns (type, value_string, end) where type in {'num','string','map'}
+    and end is the position just past the token. For 'map', value_string
+    is unused (empty).
     """
-    ch = cur.peek()
-
     # Nested map
-    if ch == '(' and cur.s[cur.i:cur.i+2] == '(<':
+    if s.startswith('(<', i):
         # Parse nested map inline
-        return 'map', ''
+        return 'map', '', i
 
-    # Otherwise scan until delimiter: ',' or '>' (end of map)
-    start = cur.i
+    # Otherwise cut the token at the next delimiter: ',' or '>' (end of
+    # map). str.find is a memchr-style search, so delimiter location costs
+    # two C scans instead of a per-character class test.
     # IMPORTANT: no whitespace allowed in tokens for nums/complex strings.
     # Simple-strings may include spaces/tabs but *must* end with trailing 's'.
-    while True:
-        c = cur.peek()
-        if c == '' or c in {',', '>'}:
-            break
-        if c in {'(', ')', '<', ':'}:
-            raise NosjError("Unexpected structural character inside value")
-        # We'll validate whitespace rules after we know the token
-        cur.i += 1
-    token = cur.s[start:cur.i]
-
-    # Classify token
-    if '%' in token:
-        decoded, had = _decode_percent_bytes(token)
-        if not had:
-            raise NosjError("Complex string must contain at least one %XX")
-        return 'string', decoded
-
-    # If token has any whitespace, it must be a simple-string by regex.
-    if any(ch in ' \t' for ch in token):
-        m = SIMPLE_STR_RE.fullmatch(token)
-        if not m:
+    j_comma = s.find(',', i)
+    j_close = s.find('>', i)
+    if j_comma < 0:
+        end = j_close if j_close >= 0 else len(s) - 1  # stop at the sentinel
+    elif j_close < 0:
+        end = j_comma
+    else:
+        end = j_comma if j_comma < j_close else j_close
+    token = s[i:end]
+
+    # Classify token from one pass over its characters. Structural
+    # characters now surface here as a class bit rather than a scan stop.
+    flags = 0
+    lut = _CLASS_LUT
+    for ch in token:
+        c = ord(ch)
+        flags |= lut[c] if c < 256 else _OTHER
+
+    if flags & _STRUCT:
+        raise NosjError("Unexpected structural character inside value")
+
+    if flags & _PCT:
+        # The _PCT flag guarantees at least one '%'; the decoder rejects
+        # any '%' that is not a well-formed %XX escape.
+        return 'string', _decode_percent_bytes(token), end
+
+    # Simple-string: body of [A-Za-z0-9 \t] with a trailing 's' marker.
+    # Whitespace anywhere else (or any _OTHER char) is invalid.
+    if flags & _WS:
+        if flags & _OTHER or len(token) < 2 or token[-1] != 's':
             raise NosjError("Whitespace outside simple-string")
-        return 'string', m.group(1)
+        return 'string', token[:-1], end
 
     # Pure token (no whitespace). Try num, then simple-string, else error.
-    if BIN_RE.fullmatch(token):
-        # num
-        val = int(token, 2)
-        nbits = len(token)
-        if token[0] == '1':  # negative
-            val -= (1 << nbits)
-        return 'num', str(val)
-
-    m = SIMPLE_STR_RE.fullmatch(token)
-    if m:
-        return 'string', m.group(1)
+    if flags and not flags & ~_BIN:
+        # num: two's complement over len(token) bits. The bool sign bit
+        # shifts to either 0 or the full weight, avoiding a branch.
+        val = int(token, 2) - ((token[0] == '1') << len(token))
+        return 'num', str(val), end
+
+    if not flags & ~(_BIN | _ALNUM | _LOWER) and len(token) >= 2 and token[-1] == 's':
+        return 'string', token[:-1], end
 
     # Otherwise treat as complex without % is NOT allowed; error.
     raise NosjError("Unrecognized value token")
 
 
-def _parse_map_body(cur: Cursor, emit: List[str]) -> None:
+def _parse_map_body(s: str, i: int, emit) -> int:
     """
-    Parse the inside of '< ... >' given cursor at first char after '<'.
-    Emits pretty lines to 'emit'.
+    Parse the inside of '< ... >' starting at the first char after '<';
+    returns the position just past the matching '>'. Calls emit(line) for
+    each pretty line, so callers can collect into a list or stream into an
+    output buffer without an intermediate list. Nested maps are handled
+    with an explicit stack of enclosing-map key sets rather than
+    recursion, so nesting depth is bounded by memory instead of the
+    interpreter recursion limit.
     """
-    seen_keys = set()
+    # Duplicate-key state per map: None while empty, the key itself while
+    # the map has exactly one (most nosj maps are tiny), and a set only
+    # from the second key on -- skipping a set allocation per small map.
+    seen_keys = None
     first = True
+    stack: List[object] = []
+    # startswith avoids the slice allocation a two-char compare would
+    # otherwise make per pair; the sentinel makes bounds checks on s[i]
+    # unnecessary.
+    startswith = s.startswith
     while True:
         # End of map?
-        if cur.peek() == '>':
-            cur.eat('>')
-            return
+        if s[i] == '>':
+            i += 1
+            if not stack:
+                return i
+            # Close a nested map and resume the enclosing one.
+            if s[i] != ')':
+                raise NosjError("Expected ')' after nested map")
+            i += 1
+            emit("end-map")
+            seen_keys = stack.pop()
+            first = False  # the nested map completed an enclosing pair
+            continue
 
         if not first:
             # Expect comma between pairs
-            if cur.peek() != ',':
+            if s[i] != ',':
                 raise NosjError("Expected ',' between key-value pairs")
-            cur.eat(',')
+            i += 1
         first = False
 
         # Parse "key:value"
-        key = _parse_key(cur)
-        if key in seen_keys:
+        key, i = _parse_key(s, i)
+        if seen_keys is None:
+            seen_keys = key
+        elif type(seen_keys) is str:
+            if key == seen_keys:
+                raise NosjError("Duplicate key in map")
+            seen_keys = {seen_keys, key}
+        elif key in seen_keys:
             raise NosjError("Duplicate key in map")
-        seen_keys.add(key)
+        else:
+            seen_keys.add(key)
 
-        if cur.peek() != ':':
+        if s[i] != ':':
             raise NosjError("Expected ':' after key")
-        cur.eat(':')
+        i += 1
 
         # Value
-        if cur.peek() == '(' and cur.s[cur.i:cur.i+2] == '(<':
-            # Nested map value
-            emit.append(f"{key} -- map -- ")
-            emit.append("begin-map")
-            # consume "(<"
-            cur.eat('('); cur.eat('<')
-            _parse_map_body(cur, emit)
-            # expect ")"
-            if cur.peek() != ')':
-                raise NosjError("Expected ')' after nested map")
-            cur.eat(')')
-            emit.append("end-map")
+        if startswith('(<', i):
+            # Nested map value: push the enclosing key set and descend.
+            emit(f"{key} -- map -- ")
+            emit("begin-map")
+            i += 2
+            stack.append(seen_keys)
+            seen_keys = None
+            first = True
         else:
-            typ, sval = _parse_value(cur)
+            typ, sval, i = _parse_value(s, i)
             if typ == 'num':
-                emit.append(f"{key} -- num -- {sval}")
+                emit(f"{key} -- num -- {sval}")
             elif typ == 'string':
-                emit.append(f"{key} -- string -- {sval}")
+                emit(f"{key} -- string -- {sval}")
             else:
                 # should not happen; maps handled above
                 raise NosjError("Internal error parsing value")
 
 
-def parse_marshalled_map(s: str) -> List[str]:
+def _parse_document(s: str, emit) -> None:
     """
-    Entry: s is the entire marshalled nosj string for *one* map.
-    Leading/trailing whitespace allowed; none inside except in simple-strings.
+    Parse one whole marshalled map, feeding pretty lines to emit().
     """
-    s = s.strip()
-    cur = Cursor(s)
+    # Surrounding whitespace is skipped in place with anchored matches
+    # rather than strip(), which would copy the whole document before the
+    # sentinel append copies it again.
+    s += _SENTINEL
 
     # Outer "(< ... >)" with optional surrounding whitespace
-    if cur.s[cur.i:cur.i+2] != '(<':
+    i = _WS_RUN.match(s).end()
+    if not s.startswith('(<', i):
         raise NosjError("Map must start with '(<'")
-    cur.eat('('); cur.eat('<')
 
-    out: List[str] = []
-    out.append("begin-map")
-    _parse_map_body(cur, out)
+    emit("begin-map")
+    i = _parse_map_body(s, i + 2, emit)
 
-    if cur.peek() != ')':
+    if s[i] != ')':
         raise NosjError("Map must end with ')'")
-    cur.eat(')')
-    if not cur.at_end():
+    if _WS_RUN.match(s, i + 1).end() != len(s) - 1:
         raise NosjError("Trailing characters after top-level map")
-    out.append("end-map")
+    emit("end-map")
+
+
+def parse_marshalled_map(s: str) -> List[str]:
+    """
+    Entry: s is the entire marshalled nosj string for *one* map.
+    Leading/trailing whitespace allowed; none inside except in simple-strings.
+    """
+    out: List[str] = []
+    _parse_document(s, out.append)
     return out
 
 
 # ---------- CLI (LF-only output and single-line error) ----------
-def _writeline_stdout(line: str) -> None:
-    sys.stdout.buffer.write((line + "\n").encode("utf-8"))
-
 def _writeline_stderr_error(msg: str) -> None:
     sys.stderr.buffer.write((f"ERROR -- {msg}\n").encode("utf-8"))
 
-def main(argv: list[str]) -> int:
-    if len(argv) != 2:
-        _writeline_stderr_error("missing input file")
-        return 66
+# Inputs at or above this size are mmapped instead of read(): the decoder
+# then pulls pages straight from the page cache without first copying the
+# whole file into a bytes object. Small files (the common case, and empty
+# files, which cannot be mmapped) take the plain read() path.
+_MMAP_THRESHOLD = 1 << 20
+
+def _process_file(path: str) -> Tuple[int, bytes, bytes]:
+    """
+    Parse one file and return (exit_code, stdout_bytes, stderr_bytes)
+    without touching the real streams, so it can run in a worker process.
+    """
     try:
-        data = open(argv[1], "r", encoding="utf-8").read()
-        for line in parse_marshalled_map(data):
-            _writeline_stdout(line)
-        return 0
+        # Read raw bytes and decode once: skips the TextIOWrapper layer and
+        # its incremental decoder/newline translation. Outer strip handles
+        # any trailing '\r\n' either way, and a bad encoding still lands in
+        # the ValueError handler below.
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = str(mm, "utf-8")
+            else:
+                data = f.read().decode("utf-8")
+        # Stream lines straight into one bytes buffer -- no intermediate
+        # list of str -- and flush it with a single write.
+        buf = bytearray()
+        extend = buf.extend
+        def emit(line: str) -> None:
+            extend(line.encode("utf-8"))
+            extend(b"\n")
+        _parse_document(data, emit)
+        return 0, bytes(buf), b""
     except FileNotFoundError:
-        _writeline_stderr_error("file not found")
-        return 66
-    except NosjError as e:
-        _writeline_stderr_error(str(e))
-        return 66
-    except ValueError as e:
-        _writeline_stderr_error(str(e))
+        return 66, b"", b"ERROR -- file not found\n"
+    except (NosjError, ValueError) as e:
+        return 66, b"", f"ERROR -- {e}\n".encode("utf-8")
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 2:
+        _writeline_stderr_error("missing input file")
         return 66
+    paths = argv[1:]
+    if len(paths) == 1:
+        results = [_process_file(paths[0])]
+    else:
+        # Each file is an independent document, so batch invocations fan
+        # out across cores. Imported lazily: the common single-file call
+        # should not pay the multiprocessing import.
+        from multiprocessing import Pool
+        with Pool(min(len(paths), os.cpu_count() or 1)) as pool:
+            results = pool.map(_process_file, paths)
+    status = 0
+    for code, out, err in results:
+        if out:
+            sys.stdout.buffer.write(out)
+        if err:
+            sys.stderr.buffer.write(err)
+        if code:
+            status = code
+    return status
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))